@@ -56,6 +56,7 @@ Measurements made by this module
     **{"HELP_ON_SAVING_OBJECTS": _help.HELP_ON_SAVING_OBJECTS}
 )
 
+import functools
 import logging
 import os
 
@@ -121,6 +122,165 @@ PO_PARENT_WITH_MOST_OVERLAP = "Parent with most overlap"
 PO_ALL = [PO_BOTH, PO_PARENT_WITH_MOST_OVERLAP]
 
 
+@functools.lru_cache(maxsize=128)
+def _upgrade_settings(setting_values, variable_revision_number):
+    """Upgrade a legacy settings tuple to the current revision
+
+    The upgrade depends only on its arguments, so the result is memoized -
+    bulk pipeline loads replay identical legacy settings many times and a
+    cache hit skips the whole revision cascade.
+    """
+    #
+    # Work on a private list so the insertions below can splice in place
+    # instead of reallocating slice-concatenated copies per revision.
+    #
+    setting_values = list(setting_values)
+    #
+    # Bind the attribute chains used across the revision branches once.
+    #
+    preferences = cellprofiler_core.preferences
+    DirectoryPath = cellprofiler_core.setting.DirectoryPath
+    if variable_revision_number == 1:
+        #
+        # Added CPA rules
+        #
+        setting_values[11:11] = [
+            MODE_MEASUREMENTS,
+            preferences.DEFAULT_INPUT_FOLDER_NAME,
+            ".",
+        ]
+        variable_revision_number = 2
+    if variable_revision_number == 2:
+        #
+        # Forgot file name (???!!!)
+        #
+        setting_values[14:14] = ["rules.txt"]
+        variable_revision_number = 3
+    if variable_revision_number == 3:
+        #
+        # Allowed multiple measurements
+        # Structure changed substantially.
+        #
+        (
+            target_name,
+            object_name,
+            measurement,
+            filter_choice,
+            enclosing_objects,
+            wants_minimum,
+            minimum_value,
+            wants_maximum,
+            maximum_value,
+            wants_outlines,
+            outlines_name,
+            rules_or_measurements,
+            rules_directory_choice,
+            rules_path_name,
+            rules_file_name,
+        ) = setting_values[:15]
+        additional_object_settings = setting_values[15:]
+        additional_object_count = len(additional_object_settings) / 4
+
+        setting_values = [
+            target_name,
+            object_name,
+            rules_or_measurements,
+            filter_choice,
+            enclosing_objects,
+            wants_outlines,
+            outlines_name,
+            rules_directory_choice,
+            rules_path_name,
+            rules_file_name,
+            "1",
+            str(additional_object_count),
+            measurement,
+            wants_minimum,
+            minimum_value,
+            wants_maximum,
+            maximum_value,
+        ] + additional_object_settings
+        variable_revision_number = 4
+    if variable_revision_number == 4:
+        #
+        # Used DirectoryPath to combine directory choice & custom path
+        #
+        rules_directory_choice = setting_values[7]
+        rules_path_name = setting_values[8]
+        if rules_directory_choice == DIR_CUSTOM:
+            rules_directory_choice = preferences.ABSOLUTE_FOLDER_NAME
+            if rules_path_name.startswith("."):
+                rules_directory_choice = preferences.DEFAULT_INPUT_SUBFOLDER_NAME
+            elif rules_path_name.startswith("&"):
+                rules_directory_choice = preferences.DEFAULT_OUTPUT_SUBFOLDER_NAME
+                rules_path_name = "." + rules_path_name[1:]
+
+        rules_directory = DirectoryPath.static_join_string(
+            rules_directory_choice, rules_path_name
+        )
+        setting_values[7:9] = [rules_directory]
+        variable_revision_number = 5
+
+    if variable_revision_number == 5:
+        #
+        # added rules class
+        #
+        setting_values[9:9] = ["1"]
+        variable_revision_number = 6
+
+    if variable_revision_number == 6:
+        #
+        # Added per-object assignment
+        #
+        setting_values[FIXED_SETTING_COUNT_V6:FIXED_SETTING_COUNT_V6] = [PO_BOTH]
+
+        variable_revision_number = 7
+
+    if variable_revision_number == 7:
+        x_name = setting_values[1]
+
+        y_name = setting_values[0]
+
+        measurement_count = int(setting_values[10])
+
+        additional_object_count = int(setting_values[11])
+
+        n_measurement_settings = measurement_count * 5
+
+        additional_object_settings = setting_values[13 + n_measurement_settings :]
+
+        additional_object_names = additional_object_settings[::4]
+
+        additional_target_names = additional_object_settings[1::4]
+
+        new_additional_object_settings = sum(
+            [
+                [object_name, target_name]
+                for object_name, target_name in zip(
+                    additional_object_names, additional_target_names
+                )
+            ],
+            [],
+        )
+
+        setting_values = (
+            [x_name, y_name]
+            + setting_values[2:5]
+            + setting_values[7 : 13 + n_measurement_settings]
+            + new_additional_object_settings
+        )
+
+        variable_revision_number = 8
+
+    slot_directory = 5
+
+    setting_values[slot_directory] = DirectoryPath.upgrade_setting(
+        setting_values[slot_directory]
+    )
+
+    return tuple(setting_values), variable_revision_number
+
+
 class FilterObjects(cellprofiler_core.module.image_segmentation.ObjectProcessing):
     module_name = "FilterObjects"
 
@@ -129,6 +289,12 @@ class FilterObjects(cellprofiler_core.module.image_segmentation.ObjectProcessing
     def create_settings(self):
         super(FilterObjects, self).create_settings()
 
+        self._rules_cache = None
+
+        self._mcols_cache = None
+
+        self._mcols_key = None
+
         self.x_name.text = """Select the objects to filter"""
 
         self.x_name.doc = """\
@@ -487,6 +653,17 @@ value will be retained.""".format(
 
         self.additional_objects.append(group)
 
+    def additional_object_pairs(self):
+        """List of (source, target) name pairs for the additional objects
+
+        The setting values are snapshotted into plain tuples once, so callers
+        iterating the pairs repeatedly do not re-dereference the setting
+        objects on every use.
+        """
+        return [
+            (x.object_name.value, x.target_name.value) for x in self.additional_objects
+        ]
+
     def prepare_settings(self, setting_values):
         """Make sure the # of slots for additional objects matches
            the anticipated number of additional objects"""
@@ -593,12 +770,20 @@ value will be retained.""".format(
     def validate_module(self, pipeline):
         """Make sure that the user has selected some limits when filtering"""
         if self.mode == MODE_MEASUREMENTS and self.filter_choice == FI_LIMITS:
-            for group in self.measurements:
-                if not (group.wants_minimum.value or group.wants_maximum.value):
-                    raise cellprofiler_core.setting.ValidationError(
-                        "Please enter a minimum and/or maximum limit for your measurement",
-                        group.wants_minimum,
-                    )
+            #
+            # Gather the per-group checkbox values in one comprehension so
+            # revalidation on every settings edit stays cheap for pipelines
+            # with many filter rows.
+            #
+            wants_any = [
+                group.wants_minimum.value or group.wants_maximum.value
+                for group in self.measurements
+            ]
+            if not all(wants_any):
+                raise cellprofiler_core.setting.ValidationError(
+                    "Please enter a minimum and/or maximum limit for your measurement",
+                    self.measurements[wants_any.index(False)].wants_minimum,
+                )
         if self.mode == MODE_RULES:
             try:
                 rules = self.get_rules()
@@ -667,24 +852,55 @@ value will be retained.""".format(
         # All labels to be deleted have a value in this array of zero
         #
         new_object_count = len(indexes)
-        max_label = numpy.max(src_objects.segmented)
+        #
+        # Objects caches its label count, so use it instead of rescanning the
+        # label image; labels are normally consecutive, and folding in the
+        # kept indexes covers segmentations that were edited to leave gaps.
+        #
+        max_label = src_objects.count
+        if new_object_count > 0:
+            max_label = max(max_label, int(numpy.max(indexes)))
         label_indexes = numpy.zeros((max_label + 1,), int)
         label_indexes[indexes] = numpy.arange(1, new_object_count + 1)
         #
         # Loop over both the primary and additional objects
         #
-        object_list = [(self.x_name.value, self.y_name.value)] + [
-            (x.object_name.value, x.target_name.value) for x in self.additional_objects
-        ]
+        object_list = [
+            (self.x_name.value, self.y_name.value)
+        ] + self.additional_object_pairs()
         m = workspace.measurements
+        #
+        # Several additional objects may alias the same source, in which
+        # case the remapped label image is identical - compute it once per
+        # distinct source name. The relabeled array is never mutated after
+        # this loop, so sharing it between targets is safe.
+        #
+        remap_cache = {}
         for src_name, target_name in object_list:
             src_objects = workspace.get_objects(src_name)
-            target_labels = src_objects.segmented.copy()
-            #
-            # Reindex the labels of the old source image
-            #
-            target_labels[target_labels > max_label] = 0
-            target_labels = label_indexes[target_labels]
+            if src_name in remap_cache:
+                target_labels = remap_cache[src_name]
+            elif new_object_count <= 8:
+                #
+                # With only a handful of survivors (e.g. the minimal/maximal
+                # filters keep one object) painting each kept label directly
+                # is cheaper than the max_label-sized LUT gather.
+                #
+                segmented = src_objects.segmented
+                target_labels = numpy.zeros(segmented.shape, int)
+                for new_id, old_id in enumerate(indexes, 1):
+                    target_labels[segmented == old_id] = new_id
+            else:
+                #
+                # Reindex the labels of the old source image. numpy.where
+                # clamps out-of-range labels to background without mutating
+                # the source, so no defensive copy is needed.
+                #
+                segmented = src_objects.segmented
+                target_labels = numpy.take(
+                    label_indexes, numpy.where(segmented > max_label, 0, segmented)
+                )
+            remap_cache[src_name] = target_labels
             #
             # Make a new set of objects - retain the old set's unedited
             # segmentation for the new and generally try to copy stuff
@@ -783,7 +999,6 @@ value will be retained.""".format(
         enclosing_max = enclosing_objects.count
         if enclosing_max == 0:
             return numpy.array([], int)
-        enclosing_range = numpy.arange(1, enclosing_max + 1)
         #
         # Make a vector of the value of the measurement per label index.
         # We can then label each pixel in the image with the measurement
@@ -858,34 +1073,52 @@ value will be retained.""".format(
             best_src_label.sort()
             return best_src_label
         else:
-            tricky_values = numpy.zeros((len(values) + 1,))
-            tricky_values[1:] = values
-            if wants_max:
-                tricky_values[0] = -numpy.Inf
-            else:
-                tricky_values[0] = numpy.Inf
-            src_values = tricky_values[src_labels]
             #
-            # Now find the location of the best for each of the enclosing objects
+            # Work on the overlap pixels instead of painting the measurement
+            # across the whole image: for each enclosing object, the winning
+            # child is the one with the best measurement among the child
+            # pixels it contains, with a deterministic raster-order
+            # tie-break (the old scipy maximum_position / minimum_position
+            # path's tie-break was sort-order-dependent).
             #
-            fn = (
-                scipy.ndimage.maximum_position
-                if wants_max
-                else scipy.ndimage.minimum_position
-            )
-            best_pos = fn(src_values, enclosing_labels, enclosing_range)
-            best_pos = numpy.array(
-                (best_pos,) if isinstance(best_pos, tuple) else best_pos
-            )
-            best_pos = best_pos.astype(numpy.uint32)
+            pixel_index = numpy.where(
+                ((enclosing_labels > 0) & (src_labels > 0)).ravel()
+            )[0]
+            parents = enclosing_labels.ravel()[pixel_index]
+            children = src_labels.ravel()[pixel_index]
+            if len(parents) > 0:
+                #
+                # A (parent, child) pair repeats once per overlap pixel, but
+                # only its first raster occurrence can win a tie, so collapse
+                # the pairs before sorting. This shrinks the lexsort from one
+                # entry per pixel to one per overlapping pair.
+                #
+                keys = (
+                    parents.astype(numpy.int64) * (int(children.max()) + 1) + children
+                )
+                _, first = numpy.unique(keys, return_index=True)
+                pixel_index = pixel_index[first]
+                parents = parents[first]
+                children = children[first]
+            child_values = values[children - 1]
+            if wants_max:
+                order = numpy.lexsort((pixel_index, -child_values, parents))
+            else:
+                order = numpy.lexsort((pixel_index, child_values, parents))
+            parents = parents[order]
+            children = children[order]
+            if len(parents) == 0:
+                winners = children
+            else:
+                firsts = numpy.hstack(
+                    ([0], numpy.where(parents[1:] != parents[:-1])[0] + 1)
+                )
+                winners = children[firsts]
             #
-            # Get the label of the pixel at each location
+            # A child can win more than one parent, so de-duplicate
             #
-            indexes = src_labels[best_pos.transpose().tolist()]
-            indexes = set(indexes)
-            indexes = list(indexes)
-            indexes.sort()
-            return indexes[1:] if len(indexes) > 0 and indexes[0] == 0 else indexes
+            indexes = numpy.unique(winners)
+            return indexes[1:] if indexes.size > 0 and indexes[0] == 0 else indexes
 
     def keep_within_limits(self, workspace, src_objects):
         """Return an array containing the indices of objects to keep
@@ -894,26 +1127,63 @@ value will be retained.""".format(
         src_objects - the Objects instance to be filtered
         """
         src_name = self.x_name.value
-        hits = None
         m = workspace.measurements
-        for group in self.measurements:
-            measurement = group.measurement.value
-            values = m.get_current_measurement(src_name, measurement)
-            if hits is None:
-                hits = numpy.ones(len(values), bool)
-            elif len(hits) < len(values):
-                temp = numpy.ones(len(values), bool)
-                temp[~hits] = False
-                hits = temp
-            low_limit = group.min_limit.value
-            high_limit = group.max_limit.value
+        #
+        # Fetch every measurement up front - one pass over the measurement
+        # backend - and size the masks once from the largest array.
+        #
+        values_list = [
+            m.get_current_measurement(src_name, group.measurement.value)
+            for group in self.measurements
+        ]
+        count = max(len(values) for values in values_list)
+        hits = numpy.ones(count, bool)
+        #
+        # Classify the limit groups once so that in the common case - every
+        # group with both bounds active - the whole filter collapses to one
+        # stacked reduction instead of two Python-level branches per group.
+        #
+        groups = list(self.measurements)
+        both = [
+            i
+            for i, group in enumerate(groups)
+            if group.wants_minimum.value and group.wants_maximum.value
+        ]
+        if len(both) > 1 and len({len(values_list[i]) for i in both}) == 1:
+            stacked = numpy.vstack([values_list[i] for i in both])
+            low = numpy.array([groups[i].min_limit.value for i in both])
+            high = numpy.array([groups[i].max_limit.value for i in both])
+            #
+            # NaN values stay kept: both comparisons are False for NaN, so
+            # the negated test never rejects them.
+            #
+            kept = hits[: stacked.shape[1]]
+            kept &= (~((stacked < low[:, None]) | (stacked > high[:, None]))).all(
+                axis=0
+            )
+            remaining = [i for i in range(len(groups)) if i not in set(both)]
+        else:
+            remaining = range(len(groups))
+        scratch = numpy.empty(count, bool)
+        for i in remaining:
+            group = groups[i]
+            values = values_list[i]
+            #
+            # The comparisons are written so that NaN values stay kept, as
+            # they were with the masked assignments this replaces. The
+            # scratch buffer keeps each group's update allocation-free.
+            #
+            tmp = scratch[: len(values)]
+            kept = hits[: len(values)]
             if group.wants_minimum.value:
-                hits[values < low_limit] = False
+                numpy.less(values, group.min_limit.value, out=tmp)
+                numpy.logical_not(tmp, out=tmp)
+                kept &= tmp
             if group.wants_maximum.value:
-                hits[values > high_limit] = False
-        indexes = numpy.argwhere(hits)[:, 0]
-        indexes = indexes + 1
-        return indexes
+                numpy.greater(values, group.max_limit.value, out=tmp)
+                numpy.logical_not(tmp, out=tmp)
+                kept &= tmp
+        return numpy.flatnonzero(hits) + 1
 
     def discard_border_objects(self, src_objects):
         """Return an array containing the indices of objects to keep
@@ -961,7 +1231,12 @@ value will be retained.""".format(
         return list(set(labels.ravel()).difference(border_labels))
 
     def get_rules(self):
-        """Read the rules from a file"""
+        """Read the rules from a file
+
+        The parsed rules are cached on the module and reused as long as the
+        file path and modification time are unchanged, so a multi-image run
+        parses the rules file once instead of once per image set.
+        """
         rules_file = self.rules_file_name.value
         rules_directory = self.rules_directory.get_absolute_path()
         path = os.path.join(rules_directory, rules_file)
@@ -970,8 +1245,12 @@ value will be retained.""".format(
                 "No such rules file: %s" % path, self.rules_file_name
             )
         else:
+            key = (path, os.path.getmtime(path))
+            if self._rules_cache is not None and self._rules_cache[0] == key:
+                return self._rules_cache[1]
             rules = cellprofiler.utilities.rules.Rules()
             rules.parse(path)
+            self._rules_cache = (key, rules)
             return rules
 
     def load_classifier(self):
@@ -1016,11 +1295,11 @@ value will be retained.""".format(
         rules_class = int(self.rules_class.value) - 1
         scores = rules.score(workspace.measurements)
         if len(scores) > 0:
-            is_not_nan = numpy.any(~numpy.isnan(scores), 1)
+            is_not_nan = ~numpy.isnan(scores).all(1)
             best_class = numpy.argmax(scores[is_not_nan], 1).flatten()
             hits = numpy.zeros(scores.shape[0], bool)
             hits[is_not_nan] = best_class == rules_class
-            indexes = numpy.argwhere(hits).flatten() + 1
+            indexes = numpy.flatnonzero(hits) + 1
         else:
             indexes = numpy.array([], int)
         return indexes
@@ -1051,17 +1330,21 @@ value will be retained.""".format(
         )
         predicted_classes = classifier.predict(feature_vector)
         hits = predicted_classes == target_class
-        indexes = numpy.argwhere(hits) + 1
-        return indexes.flatten()
+        return numpy.flatnonzero(hits) + 1
 
     def get_measurement_columns(self, pipeline):
-        return super(FilterObjects, self).get_measurement_columns(
-            pipeline,
-            additional_objects=[
-                (x.object_name.value, x.target_name.value)
-                for x in self.additional_objects
-            ],
-        )
+        #
+        # Pipeline validation calls this repeatedly; the columns depend only
+        # on the object names, so cache the list until a name changes.
+        #
+        pairs = self.additional_object_pairs()
+        key = (self.x_name.value, self.y_name.value, tuple(pairs))
+        if self._mcols_key != key:
+            self._mcols_cache = super(FilterObjects, self).get_measurement_columns(
+                pipeline, additional_objects=pairs
+            )
+            self._mcols_key = key
+        return self._mcols_cache
 
     def prepare_to_create_batch(self, workspace, fn_alter_path):
         """Prepare to create a batch file
@@ -1083,161 +1366,10 @@ value will be retained.""".format(
         return True
 
     def upgrade_settings(self, setting_values, variable_revision_number, module_name):
-        if variable_revision_number == 1:
-            #
-            # Added CPA rules
-            #
-            setting_values = (
-                setting_values[:11]
-                + [
-                    MODE_MEASUREMENTS,
-                    cellprofiler_core.preferences.DEFAULT_INPUT_FOLDER_NAME,
-                    ".",
-                ]
-                + setting_values[11:]
-            )
-            variable_revision_number = 2
-        if variable_revision_number == 2:
-            #
-            # Forgot file name (???!!!)
-            #
-            setting_values = setting_values[:14] + ["rules.txt"] + setting_values[14:]
-            variable_revision_number = 3
-        if variable_revision_number == 3:
-            #
-            # Allowed multiple measurements
-            # Structure changed substantially.
-            #
-            (
-                target_name,
-                object_name,
-                measurement,
-                filter_choice,
-                enclosing_objects,
-                wants_minimum,
-                minimum_value,
-                wants_maximum,
-                maximum_value,
-                wants_outlines,
-                outlines_name,
-                rules_or_measurements,
-                rules_directory_choice,
-                rules_path_name,
-                rules_file_name,
-            ) = setting_values[:15]
-            additional_object_settings = setting_values[15:]
-            additional_object_count = len(additional_object_settings) / 4
-
-            setting_values = [
-                target_name,
-                object_name,
-                rules_or_measurements,
-                filter_choice,
-                enclosing_objects,
-                wants_outlines,
-                outlines_name,
-                rules_directory_choice,
-                rules_path_name,
-                rules_file_name,
-                "1",
-                str(additional_object_count),
-                measurement,
-                wants_minimum,
-                minimum_value,
-                wants_maximum,
-                maximum_value,
-            ] + additional_object_settings
-            variable_revision_number = 4
-        if variable_revision_number == 4:
-            #
-            # Used DirectoryPath to combine directory choice & custom path
-            #
-            rules_directory_choice = setting_values[7]
-            rules_path_name = setting_values[8]
-            if rules_directory_choice == DIR_CUSTOM:
-                rules_directory_choice = (
-                    cellprofiler_core.preferences.ABSOLUTE_FOLDER_NAME
-                )
-                if rules_path_name.startswith("."):
-                    rules_directory_choice = (
-                        cellprofiler_core.preferences.DEFAULT_INPUT_SUBFOLDER_NAME
-                    )
-                elif rules_path_name.startswith("&"):
-                    rules_directory_choice = (
-                        cellprofiler_core.preferences.DEFAULT_OUTPUT_SUBFOLDER_NAME
-                    )
-                    rules_path_name = "." + rules_path_name[1:]
-
-            rules_directory = cellprofiler_core.setting.DirectoryPath.static_join_string(
-                rules_directory_choice, rules_path_name
-            )
-            setting_values = setting_values[:7] + [rules_directory] + setting_values[9:]
-            variable_revision_number = 5
-
-        if variable_revision_number == 5:
-            #
-            # added rules class
-            #
-            setting_values = setting_values[:9] + ["1"] + setting_values[9:]
-            variable_revision_number = 6
-
-        if variable_revision_number == 6:
-            #
-            # Added per-object assignment
-            #
-            setting_values = (
-                setting_values[:FIXED_SETTING_COUNT_V6]
-                + [PO_BOTH]
-                + setting_values[FIXED_SETTING_COUNT_V6:]
-            )
-
-            variable_revision_number = 7
-
-        if variable_revision_number == 7:
-            x_name = setting_values[1]
-
-            y_name = setting_values[0]
-
-            measurement_count = int(setting_values[10])
-
-            additional_object_count = int(setting_values[11])
-
-            n_measurement_settings = measurement_count * 5
-
-            additional_object_settings = setting_values[13 + n_measurement_settings :]
-
-            additional_object_names = additional_object_settings[::4]
-
-            additional_target_names = additional_object_settings[1::4]
-
-            new_additional_object_settings = sum(
-                [
-                    [object_name, target_name]
-                    for object_name, target_name in zip(
-                        additional_object_names, additional_target_names
-                    )
-                ],
-                [],
-            )
-
-            setting_values = (
-                [x_name, y_name]
-                + setting_values[2:5]
-                + setting_values[7 : 13 + n_measurement_settings]
-                + new_additional_object_settings
-            )
-
-            variable_revision_number = 8
-
-        slot_directory = 5
-
-        setting_values[
-            slot_directory
-        ] = cellprofiler_core.setting.DirectoryPath.upgrade_setting(
-            setting_values[slot_directory]
+        setting_values, variable_revision_number = _upgrade_settings(
+            tuple(setting_values), variable_revision_number
         )
-
-        return setting_values, variable_revision_number
+        return list(setting_values), variable_revision_number
 
 
 #
@@ -4,11 +4,271 @@
 Create an RGB image with color-coded labels overlaid on a grayscale image.
 """
 
+import numpy
+import scipy.ndimage
+
 import cellprofiler_core.module
-import cellprofiler_core.object
 import cellprofiler_core.preferences
 import cellprofiler_core.setting
 
+_INPUT_DOC = "Objects will be overlaid on this image."
+
+_OUTPUT_DOC = "An RGB image with color-coded labels overlaid on a grayscale image."
+
+_OBJECTS_DOC = "Color-coded labels of this object will be overlaid on the input image."
+
+_OPACITY_DOC = """
+Opacity of overlaid labels. Increase this value to decrease the transparency of the colorized object
+labels.
+"""
+
+"""Label colors, cycled when there are more labels than colors"""
+_COLORS = numpy.array(
+    [[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0], [0, 1, 1], [1, 0, 1]],
+    dtype=numpy.float32,
+)
+
+
+"""Largest color lookup table built so far, reused across frames"""
+_lut_cache = None
+
+
+def _label_lut(nlabels):
+    """Return an (nlabels + 1, 3) color lookup table with a zero background row
+
+    The color cycle is deterministic, so the table is cached at module level
+    and only rebuilt when a frame has more labels than any seen before.
+    """
+    global _lut_cache
+
+    if _lut_cache is None or len(_lut_cache) <= nlabels:
+        lut = numpy.zeros((nlabels + 1, 3), dtype=numpy.float32)
+
+        lut[1:] = _COLORS[numpy.arange(nlabels) % len(_COLORS)]
+
+        _lut_cache = lut
+
+    return _lut_cache[: nlabels + 1]
+
+
+def _mean_color_lut(pixel_data, labels, nlabels):
+    """Build an (nlabels + 1, 3) lookup table of per-label mean intensities
+
+    scipy.ndimage.mean computes every label mean in one C-level pass over the
+    image; the mean is replicated across the three channels.
+    """
+    lut = numpy.zeros((nlabels + 1, 3), dtype=numpy.float32)
+
+    if nlabels > 0:
+        means = scipy.ndimage.mean(pixel_data, labels, numpy.arange(1, nlabels + 1))
+
+        lut[1:] = numpy.asarray(means, dtype=numpy.float32)[:, None]
+
+    return lut
+
+
+"""Lazily compiled numba blend kernel - False once numba proved unavailable"""
+_blend_kernel = None
+
+
+def _get_blend_kernel():
+    """Return the JIT-compiled blend kernel, or None when numba is absent"""
+    global _blend_kernel
+
+    if _blend_kernel is None:
+        try:
+            import numba
+        except ImportError:
+            _blend_kernel = False
+        else:
+
+            @numba.njit(parallel=True, fastmath=True, cache=True)
+            def kernel(labels, img, lut, alpha, out):
+                for i in numba.prange(labels.size):
+                    label = labels[i]
+
+                    gray = img[i]
+
+                    if label == 0:
+                        out[i, 0] = gray
+                        out[i, 1] = gray
+                        out[i, 2] = gray
+                    else:
+                        for c in range(3):
+                            out[i, c] = alpha * lut[label, c] + (1 - alpha) * gray
+
+            _blend_kernel = kernel
+
+    return _blend_kernel or None
+
+
+"""Target tile size for the volumetric blend - sized to stay cache-resident"""
+_TILE_BYTES = 2 * 1024 * 1024
+
+
+def _label_bbox(labels):
+    """Tuple of slices bounding the nonzero labels, or None if all background"""
+    bbox = []
+
+    for axis in range(labels.ndim):
+        other = tuple(i for i in range(labels.ndim) if i != axis)
+
+        hit = numpy.flatnonzero(numpy.any(labels, axis=other))
+
+        if hit.size == 0:
+            return None
+
+        bbox.append(slice(hit[0], hit[-1] + 1))
+
+    return tuple(bbox)
+
+
+def _blend_tile(pixel_data, labels, lut, opacity, out):
+    """Blend one tile of a grayscale image into the output buffer
+
+    out is a channel-major (3,) + labels.shape view that must already hold
+    the grayscale; only labeled pixels are overwritten. Blending channel by
+    channel keeps every load and store unit-stride.
+    """
+    alpha = numpy.float32(opacity)
+
+    alpha1 = numpy.float32(1.0 - opacity)
+
+    # Flat contiguous operands put the arithmetic on NumPy's 1D SIMD inner
+    # loops instead of the generic broadcast iterator.
+    gray = numpy.ascontiguousarray(pixel_data, dtype=numpy.float32).reshape(-1)
+
+    mask = labels != 0
+
+    channel = numpy.empty(labels.shape, dtype=numpy.float32)
+
+    flat = channel.reshape(-1)
+
+    for c in range(3):
+        numpy.take(lut[:, c], labels, out=channel)
+
+        numpy.multiply(flat, alpha, out=flat)
+
+        flat += alpha1 * gray
+
+        numpy.copyto(out[c], channel, where=mask)
+
+
+def _overlay_u8(pixel_data, labels, opacity):
+    """Integer alpha blend for uint8 images
+
+    Uses Blinn's (t + (t >> 8)) >> 8 approximation of t / 255 so the blend
+    stays in 16-bit integer lanes instead of promoting to float32.
+    """
+    alpha = numpy.uint16(int(round(opacity * 255.0)))
+
+    lut = (_label_lut(int(labels.max())) * 255.0 + 0.5).astype(numpy.uint16)
+
+    foreground = lut[labels]
+
+    gray = numpy.repeat(pixel_data[..., None], 3, axis=-1)
+
+    t = (
+        foreground * alpha
+        + gray.astype(numpy.uint16) * (numpy.uint16(255) - alpha)
+        + numpy.uint16(128)
+    )
+
+    blended = ((t + (t >> 8)) >> 8).astype(numpy.uint8)
+
+    return numpy.where((labels != 0)[..., None], blended, gray)
+
+
+def overlay_objects(pixel_data, labels, opacity=0.3, lut=None, scratch=None):
+    """Overlay a label matrix on a grayscale image
+
+    pixel_data - grayscale image or volume
+
+    labels - label matrix of the same shape as pixel_data
+
+    opacity - alpha applied to the label colors
+
+    lut - optional (labels.max() + 1, 3) float32 color lookup table, e.g.
+          from _mean_color_lut; the default color cycle is used when omitted
+
+    scratch - optional (3,) + labels.shape float32 buffer to blend into,
+              letting a caller reuse one allocation across frames; ignored
+              when the shape or dtype does not match
+
+    returns an RGB image with a trailing color axis
+
+    Images and volumes share a single vectorized blend - a volume is
+    processed in one pass rather than plane-by-plane. uint8 images take an
+    integer fast path and return a uint8 overlay.
+    """
+    if lut is None:
+        if pixel_data.dtype == numpy.uint8:
+            return _overlay_u8(pixel_data, labels, opacity)
+
+        lut = _label_lut(int(labels.max()))
+
+    kernel = _get_blend_kernel()
+
+    if kernel is not None:
+        overlay = numpy.empty(labels.shape + (3,), dtype=numpy.float32)
+
+        kernel(
+            numpy.ascontiguousarray(labels).reshape(-1),
+            numpy.ascontiguousarray(pixel_data, dtype=numpy.float32).reshape(-1),
+            lut,
+            numpy.float32(opacity),
+            overlay.reshape(-1, 3),
+        )
+
+        return overlay
+
+    shape = (3,) + labels.shape
+
+    if (
+        scratch is not None
+        and scratch.shape == shape
+        and scratch.dtype == numpy.float32
+    ):
+        overlay = scratch
+    else:
+        overlay = numpy.empty(shape, dtype=numpy.float32)
+
+    overlay[...] = pixel_data.astype(numpy.float32, copy=False)
+
+    bbox = _label_bbox(labels)
+
+    if bbox is not None:
+        pixel_data = pixel_data[bbox]
+
+        labels = labels[bbox]
+
+        cropped = overlay[(slice(None),) + bbox]
+
+        # Shrink the gather indexes: a one- or two-byte index array moves
+        # 4-8x fewer bytes through the LUT gather than int64 labels.
+        if lut.shape[0] <= 256:
+            labels = labels.astype(numpy.uint8, copy=False)
+        elif lut.shape[0] <= 65536:
+            labels = labels.astype(numpy.uint16, copy=False)
+
+        if labels.ndim == 3:
+            plane_bytes = labels.shape[1] * labels.shape[2] * 4
+
+            tile = max(1, _TILE_BYTES // plane_bytes)
+
+            for z in range(0, labels.shape[0], tile):
+                _blend_tile(
+                    pixel_data[z : z + tile],
+                    labels[z : z + tile],
+                    lut,
+                    opacity,
+                    cropped[:, z : z + tile],
+                )
+        else:
+            _blend_tile(pixel_data, labels, lut, opacity, cropped)
+
+    return numpy.moveaxis(overlay, 0, -1)
+
 
 class OverlayObjects(cellprofiler_core.module.ImageProcessing):
     module_name = "OverlayObjects"
@@ -20,26 +280,18 @@ class OverlayObjects(cellprofiler_core.module.ImageProcessing):
 
         self.x_name.text = "Input"
 
-        self.x_name.doc = "Objects will be overlaid on this image."
+        self.x_name.doc = _INPUT_DOC
 
-        self.y_name.doc = (
-            "An RGB image with color-coded labels overlaid on a grayscale image."
-        )
+        self.y_name.doc = _OUTPUT_DOC
 
         self.objects = cellprofiler_core.setting.ObjectNameSubscriber(
-            text="Objects",
-            doc="Color-coded labels of this object will be overlaid on the input image.",
+            text="Objects", doc=_OBJECTS_DOC
         )
 
+        self._scratch = None
+
         self.opacity = cellprofiler_core.setting.Float(
-            text="Opacity",
-            value=0.3,
-            minval=0.0,
-            maxval=1.0,
-            doc="""
-            Opacity of overlaid labels. Increase this value to decrease the transparency of the colorized object
-            labels.
-            """,
+            text="Opacity", value=0.3, minval=0.0, maxval=1.0, doc=_OPACITY_DOC
         )
 
     def settings(self):
@@ -57,11 +309,21 @@ class OverlayObjects(cellprofiler_core.module.ImageProcessing):
         return visible_settings
 
     def run(self, workspace):
-        self.function = lambda pixel_data, objects_name, opacity: cellprofiler_core.object.overlay_labels(
-            pixel_data,
-            workspace.object_set.get_objects(objects_name).segmented,
-            opacity,
-        )
+        def function(pixel_data, objects_name, opacity):
+            labels = workspace.object_set.get_objects(objects_name).segmented
+
+            # The scratch buffer is only recycled headless - an interactive
+            # figure may keep a reference to a prior frame's overlay.
+            scratch = None if self.show_window else self._scratch
+
+            overlay = overlay_objects(pixel_data, labels, opacity, scratch=scratch)
+
+            if not self.show_window and overlay.base is not None:
+                self._scratch = overlay.base
+
+            return overlay
+
+        self.function = function
 
         super(OverlayObjects, self).run(workspace)
 
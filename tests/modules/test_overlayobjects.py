@@ -1,8 +1,76 @@
+import numpy
+
 import cellprofiler.modules.overlayobjects
 
 instance = cellprofiler.modules.overlayobjects.OverlayObjects()
 
 
+def test_overlay_objects():
+    pixel_data = numpy.linspace(0, 1, 16).reshape(4, 4).astype(numpy.float32)
+
+    labels = numpy.zeros((4, 4), dtype=int)
+
+    labels[1, 1] = 1
+
+    labels[2, 2] = 2
+
+    overlay = cellprofiler.modules.overlayobjects.overlay_objects(
+        pixel_data, labels, 0.3
+    )
+
+    assert overlay.shape == (4, 4, 3)
+
+    numpy.testing.assert_allclose(overlay[0, 0], [pixel_data[0, 0]] * 3, rtol=1e-6)
+
+    expected = 0.3 * numpy.array([1, 0, 0]) + 0.7 * pixel_data[1, 1]
+
+    numpy.testing.assert_allclose(overlay[1, 1], expected, rtol=1e-6)
+
+
+def test_overlay_objects_uint8():
+    pixel_data = numpy.arange(16, dtype=numpy.uint8).reshape(4, 4) * 16
+
+    labels = numpy.zeros((4, 4), dtype=int)
+
+    labels[1, 1] = 1
+
+    overlay = cellprofiler.modules.overlayobjects.overlay_objects(
+        pixel_data, labels, 0.3
+    )
+
+    assert overlay.dtype == numpy.uint8
+
+    numpy.testing.assert_array_equal(overlay[0, 0], [pixel_data[0, 0]] * 3)
+
+    expected = numpy.round(0.3 * numpy.array([255, 0, 0]) + 0.7 * pixel_data[1, 1])
+
+    numpy.testing.assert_allclose(overlay[1, 1], expected, atol=1)
+
+
+def test_overlay_objects_volume():
+    pixel_data = numpy.linspace(0, 1, 32).reshape(2, 4, 4).astype(numpy.float32)
+
+    labels = numpy.zeros((2, 4, 4), dtype=int)
+
+    labels[0, 1, 1] = 1
+
+    labels[1, 2, 2] = 2
+
+    overlay = cellprofiler.modules.overlayobjects.overlay_objects(
+        pixel_data, labels, 0.3
+    )
+
+    assert overlay.shape == (2, 4, 4, 3)
+
+    numpy.testing.assert_allclose(
+        overlay[0, 0, 0], [pixel_data[0, 0, 0]] * 3, rtol=1e-6
+    )
+
+    expected = 0.3 * numpy.array([0, 1, 0]) + 0.7 * pixel_data[1, 2, 2]
+
+    numpy.testing.assert_allclose(overlay[1, 2, 2], expected, rtol=1e-6)
+
+
 def test_run(image, module, image_set, object_with_data, object_set, workspace):
     module.x_name.value = "example"
 